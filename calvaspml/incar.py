@@ -1,5 +1,26 @@
+import os
 import re
+import shutil
+import tempfile
+import functools
 from pathlib import Path
+from typing import Iterable
+
+
+@functools.lru_cache(maxsize=256)
+def _get_pattern(tag: str):
+    """Шаблон поиска значения тэга, компилируется один раз на тэг."""
+    escaped = re.escape(tag.encode())
+    return re.compile(rb"^[ \t]*(" + escaped + rb")[ \t]*=[ \t]*([^#!\n]*)", re.MULTILINE)
+
+
+@functools.lru_cache(maxsize=256)
+def _edit_pattern(tags: tuple):
+    """Общий шаблон строки 'TAG = значение' для набора тэгов (один проход по файлу)."""
+    alternation = b"|".join(re.escape(tag.encode()) for tag in sorted(tags, key=len, reverse=True))
+    return re.compile(rb"^([ \t]*)(" + alternation + rb")[ \t]*=[ \t]*([^#!\n]*)([#!][^\n]*)?(?:\n|\Z)",
+                      re.MULTILINE)
+
 
 class IncarFile:
     BOOL_MAP = {'.TRUE.': True, '.FALSE.': False}
@@ -9,66 +30,104 @@ class IncarFile:
         self.filepath = filepath
         if not self.filepath.exists():
             raise FileNotFoundError(f"{self.filepath} not found")
+        self._data_cache = None  # (st_mtime_ns, содержимое файла)
 
     def _parse_value(self, raw: str):
         v = raw.strip()
         up = v.upper()
         if up in self.BOOL_MAP:
             return self.BOOL_MAP[up]
-        if re.fullmatch(r"[+-]?\d+", v):
+        if not v or "_" in v:  # int()/float() допускают '1_000'
+            return v
+        try:
             return int(v)
-        if re.fullmatch(r"[+-]?(\d+\.\d*|\.\d+)([eE][+-]?\d+)?", v) \
-           or re.fullmatch(r"[+-]?\d+[eE][+-]?\d+", v):
-            return float(v)
+        except ValueError:
+            pass
+        # последний символ отсекает inf/nan, которые тоже понимает float()
+        if v[-1].isdigit() or v[-1] == ".":
+            try:
+                return float(v)
+            except ValueError:
+                pass
         return v  # всё остальное — строка
 
     def get(self, tag, default=None):
         """Сканируем файл — возвращаем первое значение тэга или default."""
-        pattern = re.compile(rf"^\s*({re.escape(tag)})\s*=\s*([^#!]+)")
-        with self.filepath.open() as f:
-            for line in f:
-                m = pattern.match(line)
-                if m:
-                    raw_val = m.group(2)
-                    return self._parse_value(raw_val)
+        m = _get_pattern(tag).search(self._read_bytes())
+        if m:
+            return self._parse_value(m.group(2).decode())
         return default
 
+    def _read_bytes(self) -> bytes:
+        """Содержимое файла; повторное чтение только если файл изменился."""
+        mtime_ns = self.filepath.stat().st_mtime_ns
+        if self._data_cache is None or self._data_cache[0] != mtime_ns:
+            self._data_cache = (mtime_ns, self.filepath.read_bytes())
+        return self._data_cache[1]
+
     def set(self, tag, value):
         """
         Заменяем все вхождения tag или добавляем в конец.
         Сохраняем комментарии.
         """
-        val_str = (self.INV_BOOL_MAP[value]
-                   if isinstance(value, bool)
-                   else str(value))
-        tag_pat = re.compile(rf"^(\s*)({re.escape(tag)})\s*=\s*([^#!]*)([#!].*)?$")
-        lines = []
-        found = False
-
-        for line in self.filepath.open():
-            m = tag_pat.match(line)
-            if m:
-                indent, key, old_val, comment = m.groups()
-                comment = comment or ""
-                new_line = f"{indent}{key} = {val_str}{comment}\n"
-                lines.append(new_line)
-                found = True
-            else:
-                lines.append(line)
-
-        if not found:
-            # добавим в конец (с пустой строкой перед, если нужно)
-            if lines and not lines[-1].endswith("\n"):
-                lines[-1] += "\n"
-            lines.append(f"{tag} = {val_str}\n")
-
-        self.filepath.write_text("".join(lines))
+        self.update({tag: value})
 
     def delete(self, tag):
         """Удаляем все строки, где стоит tag = ..."""
-        tag_pat = re.compile(rf"^\s*{re.escape(tag)}\s*=")
-        new_lines = []
-        for line in self.filepath.open():
-            if not tag_pat.match(line):
-                new_lines.append(line)
-        self.filepath.write_text("".join(new_lines))
+        self.update({}, [tag])
+
+    def update(self, mapping: dict, deletions: Iterable = ()):
+        """
+        Изменяем несколько тэгов за один проход по файлу:
+        тэги из mapping заменяются (или добавляются в конец),
+        строки с тэгами из deletions удаляются.
+        """
+        deletions = {tag.encode() for tag in deletions}
+        values = {tag.encode(): self._format_value(value).encode() for tag, value in mapping.items()}
+        tags = tuple(sorted(tag.decode() for tag in deletions | values.keys()))
+        if not tags:
+            return
+
+        seen = set()
+
+        def replace(m):
+            indent, key, old_val, comment = m.groups()
+            if key in deletions:
+                return b""
+            seen.add(key)
+            return indent + key + b" = " + values[key] + (comment or b"") + b"\n"
+
+        # замена и удаление строк одним проходом regex на уровне C, без цикла по строкам
+        data = self._read_bytes()
+        new_data = _edit_pattern(tags).sub(replace, data)
+
+        for tag, val in values.items():
+            if tag in seen or tag in deletions:
+                continue
+            # добавим в конец (с переводом строки перед, если нужно)
+            if new_data and not new_data.endswith(b"\n"):
+                new_data += b"\n"
+            new_data += tag + b" = " + val + b"\n"
+
+        if new_data != data:
+            self._write_bytes(new_data)
+
+    def _format_value(self, value) -> str:
+        return (self.INV_BOOL_MAP[value]
+                if isinstance(value, bool)
+                else str(value))
+
+    def _write_bytes(self, data: bytes):
+        """Атомарная запись: временный файл в той же директории + os.replace."""
+        with tempfile.NamedTemporaryFile(mode="wb",
+                                         dir=self.filepath.parent,
+                                         prefix=f".{self.filepath.name}.",
+                                         delete=False) as tmp:
+            tmp.write(data)
+        try:
+            shutil.copymode(self.filepath, tmp.name)
+            os.replace(tmp.name, self.filepath)
+            self._data_cache = None
+        except BaseException:
+            os.unlink(tmp.name)
+            raise
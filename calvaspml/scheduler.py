@@ -1,19 +1,29 @@
 #!/usr/bin/env python3
 
 import os
+import re
 import json
 import argparse
+import asyncio
+import functools
 import subprocess
-import shutil
 import time
-import json
 import logging
 import tempfile
 from logging import Logger
-from typing import List
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
 from pathlib import Path
 from string import Template
 
+from utils import fast_copy, InotifyWatcher
+from task import reduce_job_statuses
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 
 
 class SlurmSubmissionError(Exception):
@@ -24,93 +34,308 @@ class SlurmScontrolError(Exception):
     pass
 
 
+class SlurmSqueueError(Exception):
+    pass
+
+
 class CalypsoError(Exception):
     pass
 
 
-def prepare_job_script(template_path, command):
+def _json_loads(data: bytes):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _json_dumps(obj) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj).encode()
+
+
+_SUBMITTED_RE = re.compile(r'Submitted batch job (\d+)')
+_JOBSTATE_RE = re.compile(r'JobState=(\S+)')
+_JOB_NAME_RE = re.compile(r'[A-Za-z0-9_.-]+')
+_SLURM_VERSION_RE = re.compile(r'(\d+)\.(\d+)')
+
+
+def _atomic_write_json(path: Path, obj) -> None:
+    # запись во временный файл рядом и os.replace: при сбое остаётся старый файл целиком
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.stem}.", suffix=".tmp")
+    try:
+        try:
+            os.fchmod(fd, 0o644)  # mkstemp создаёт файл с правами 0600
+            os.write(fd, _json_dumps(obj))
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+@functools.lru_cache(maxsize=64)
+def _load_json_cached(path: str, mtime_ns: int, size: int):
+    # mtime_ns и размер входят в ключ: изменённый файл перечитывается, число записей ограничено
+    with open(path, 'rb') as f:
+        return _json_loads(f.read())
+
+
+def load_json(path: Path):
+    st = os.stat(path)
+    return _load_json_cached(str(path), st.st_mtime_ns, st.st_size)
+
+
+def _decode_output(data: bytes) -> str:
+    return data.decode('utf-8', 'replace')
+
+
+@functools.lru_cache(maxsize=8)
+def _load_template(template_path: str, mtime_ns: int) -> Template:
+    # mtime_ns входит в ключ кэша, чтобы правка шаблона подхватывалась без перезапуска
     with open(template_path, 'r') as f:
-        template_content = f.read()
-    template = Template(template_content)
+        return Template(f.read())
+
+
+def load_template(template_path: Path) -> Template:
+    return _load_template(str(template_path), Path(template_path).stat().st_mtime_ns)
+
+
+def prepare_job_script(template_path, command):
+    template = load_template(template_path)
     return template.safe_substitute(COMMAND=command)
 
 
-def submit_job(template_path: Path, cwd: Path, job_name: str) -> int:
-    with open(template_path, 'r') as f:
-        template_content = f.read()
+TASK_SCRIPT_PATH = Path(os.path.dirname(os.path.abspath(__file__))) / "task.py"
+
 
-    script_path = Path(os.path.dirname(os.path.abspath(__file__))) / "task.py"
-    script_path.resolve()
+@functools.lru_cache(maxsize=8)
+def _render_task_script(template_path: str, mtime_ns: int) -> bytes:
+    template = _load_template(template_path, mtime_ns)
+    return template.safe_substitute(TASK_SCRIPT=TASK_SCRIPT_PATH).encode() # TODO: <- доработать
 
-    template = Template(template_content)
-    script_content = template.safe_substitute(TASK_SCRIPT=script_path) # TODO: <- доработать
 
-    with tempfile.NamedTemporaryFile(mode='w', delete=False, suffix='.slurm') as tmp_file:
-        tmp_file.write(script_content)
-        tmp_file_path = tmp_file.name
+def render_task_script(template_path: Path) -> bytes:
+    return _render_task_script(str(template_path), Path(template_path).stat().st_mtime_ns)
+
+
+def submit_job(template_path: Path, cwd: Path, job_name: str) -> int:
+    # имя уходит в argv sbatch как есть: пробелы и спецсимволы отсекаем заранее
+    if not _JOB_NAME_RE.fullmatch(job_name):
+        raise SlurmSubmissionError(f"Недопустимое имя задания slurm: {job_name!r}")
+
+    script_content = render_task_script(template_path)
 
+    # скрипт кладётся в рабочую директорию задания: sbatch читает его с той же ФС
+    fd, tmp_file_path = tempfile.mkstemp(suffix='.slurm', dir=cwd)
     try:
+        try:
+            os.write(fd, script_content)
+        finally:
+            os.close(fd)
+
         params = ["sbatch", f"--job-name={job_name}", f"{tmp_file_path}"]
         result = subprocess.run(
             params,
             capture_output=True, 
-            text=True, 
             check=True,
-            #shell=True,
             cwd=cwd,
-            #executable='/bin/bash'
         )
-        output = result.stdout.strip()
-        parts = output.split()
-        if len(parts) >= 4 and parts[0] == "Submitted" and parts[1] == "batch" and parts[2] == "job":
-            job_id = int(parts[3])
-            return job_id
+        output = _decode_output(result.stdout).strip()
+        match = _SUBMITTED_RE.search(output)
+        if match:
+            return int(match.group(1))
         else:
             raise SlurmSubmissionError(f"Не удалось разобрать вывод sbatch: {output}")
     except subprocess.CalledProcessError as e:
-        raise SlurmSubmissionError(f"Ошибка при отправке задания ({params}):\n {e.stderr}") from e
+        raise SlurmSubmissionError(f"Ошибка при отправке задания ({params}):\n {_decode_output(e.stderr)}") from e
     finally:
         os.remove(tmp_file_path)
 
 
-def parse_scontrol_output(output):
-    info = {}
-    for token in output.split():
-        if '=' in token:
-            key, value = token.split("=", 1)
-            info[key] = value
-    return info
+async def _run_blocking(func, *args):
+    # блокирующие вызовы (sbatch, squeue, копирование) уходят в пул потоков и не держат цикл событий
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, functools.partial(func, *args))
+
+
+@functools.lru_cache(maxsize=1)
+def _scontrol_supports_json() -> bool:
+    # scontrol --json появился в Slurm 20.11; версию проверяем один раз за процесс
+    try:
+        result = subprocess.run(["scontrol", "--version"], capture_output=True, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return False
+    match = _SLURM_VERSION_RE.search(_decode_output(result.stdout))
+    return match is not None and (int(match.group(1)), int(match.group(2))) >= (20, 11)
+
+
+def _job_state_from_json(data: bytes) -> str:
+    try:
+        jobs = _json_loads(data).get("jobs") or []
+        state = jobs[0].get("job_state", "UNKNOWN") if jobs else "UNKNOWN"
+    except (ValueError, AttributeError, TypeError) as e:
+        # предупреждения плагина перед JSON или оборванный ответ: get_job_status перейдёт на -o
+        raise SlurmScontrolError(f"Не удалось разобрать вывод scontrol --json: {e}")
+    # в новых версиях Slurm job_state — список флагов, основное состояние первое
+    if isinstance(state, list):
+        return state[0] if state else "UNKNOWN"
+    return state
 
 
 def get_job_status(job_id):
+    if _scontrol_supports_json():
+        try:
+            return _scontrol_job_state(job_id, use_json=True)
+        except SlurmScontrolError:
+            # --json требует плагин сериализации (data_parser), без него остаётся вывод -o
+            pass
+    return _scontrol_job_state(job_id, use_json=False)
+
+
+def _scontrol_job_state(job_id, use_json: bool) -> str:
+    params = ["scontrol", "--json", "show", "job", f"{job_id}"] if use_json \
+        else ["scontrol", "-o", "show", "job", f"{job_id}"]
     try:
         result = subprocess.run(
-            ["scontrol", "show", "job", f"{job_id}"],
+            params,
             capture_output=True, 
-            text=True, 
             check=True,
-            #shell=True,
-            #executable='/bin/bash'
         )
-        output = result.stdout.strip()
+        if use_json:
+            return _job_state_from_json(result.stdout)
+
+        output = _decode_output(result.stdout).strip()
 
         if "slurm_load_jobs error:" in output or "Invalid job id specified" in output:
             return "UNKNOWN"
 
-        job_info = parse_scontrol_output(output)
-        return job_info.get("JobState", "UNKNOWN")
+        # -o: одна строка Key=Value на задание, из неё нужно только поле JobState
+        match = _JOBSTATE_RE.search(output)
+        return match.group(1) if match else "UNKNOWN"
     except subprocess.CalledProcessError as e:
-        err_msg = e.stderr.strip()
-        if "Invalid job id specified" in err_msg:
+        err_msg = _decode_output(e.stderr).strip()
+        # с --json описание ошибки приходит в stdout внутри JSON
+        if "Invalid job id specified" in err_msg or b"Invalid job id specified" in e.stdout:
             return "UNKNOWN"
         raise SlurmScontrolError(f"Ошибка при выполнении scontrol: {err_msg}")
 
 
+def get_job_statuses(job_ids: List[str]) -> Dict[str, str]:
+    job_ids = [str(job_id) for job_id in job_ids]
+    statuses = {job_id: "UNKNOWN" for job_id in job_ids}
+    if not job_ids:
+        return statuses
+
+    try:
+        result = subprocess.run(
+            ["squeue", "--noheader", f"--jobs={','.join(job_ids)}", "--format=%i %T"],
+            capture_output=True,
+            check=True,
+        )
+    except subprocess.CalledProcessError as e:
+        err_msg = _decode_output(e.stderr).strip()
+        # завершённые задания пропадают из squeue, для них остаётся UNKNOWN
+        if "Invalid job id specified" in err_msg:
+            return statuses
+        raise SlurmSqueueError(f"Ошибка при выполнении squeue: {err_msg}")
+
+    for line in _decode_output(result.stdout).splitlines():
+        parts = line.split()
+        if len(parts) >= 2 and parts[0] in statuses:
+            statuses[parts[0]] = parts[1]
+
+    return statuses
+
+
+def get_job_accounting_statuses(job_ids: List[str]) -> Dict[str, str]:
+    job_ids = [str(job_id) for job_id in job_ids]
+    statuses = {job_id: "UNKNOWN" for job_id in job_ids}
+    if not job_ids:
+        return statuses
+
+    try:
+        result = subprocess.run(
+            ["sacct", "--noheader", "--parsable2", "--allocations",
+             f"--jobs={','.join(job_ids)}", "--format=JobID,State"],
+            capture_output=True,
+            check=True,
+        )
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        # учёт заданий в кластере может быть отключён — тогда состояние остаётся UNKNOWN
+        return statuses
+
+    for line in _decode_output(result.stdout).splitlines():
+        parts = line.split("|")
+        if len(parts) >= 2 and parts[0] in statuses and parts[1]:
+            # например, "CANCELLED by 1000"
+            statuses[parts[0]] = parts[1].split()[0]
+
+    return statuses
+
+
+class SlurmStatusCache():
+    def __init__(self):
+        self._statuses: Dict[str, str] = {}
+        self.fetched_at = None
+
+    def refresh(self, job_ids: List[str]) -> None:
+        # один вызов squeue на все отслеживаемые задания, sacct — только для выпавших из очереди
+        job_ids = [str(job_id) for job_id in job_ids]
+        statuses = get_job_statuses(job_ids)
+
+        missing = [job_id for job_id, status in statuses.items() if status == "UNKNOWN"]
+        if missing:
+            statuses.update(get_job_accounting_statuses(missing))
+
+        # без учёта заданий (sacct) завершённое задание ещё MinJobAge секунд видно в scontrol
+        for job_id in [job_id for job_id in missing if statuses[job_id] == "UNKNOWN"]:
+            try:
+                statuses[job_id] = get_job_status(job_id)
+            except (SlurmScontrolError, OSError):
+                pass
+
+        self._statuses = statuses
+        self.fetched_at = time.monotonic()
+
+    async def refresh_async(self, job_ids: List[str]) -> None:
+        await _run_blocking(self.refresh, job_ids)
+
+    def get(self, job_id) -> str:
+        return self._statuses.get(str(job_id), "UNKNOWN")
+
+
+
+# Номера из имён вида PREFIX_<N>: префикс фиксирован, поэтому срез вместо split('_')
+def _name_idx(suffix: str) -> int:
+    # int() принял бы и "1_0", " 1", "+1"; такие имена считаем посторонними
+    if not (suffix.isascii() and suffix.isdigit()):
+        raise ValueError(f"Некорректный номер в имени: {suffix!r}")
+    return int(suffix)
+
+
+def _poscar_idx(entry) -> int:
+    return _name_idx(entry.name[7:])  # len("POSCAR_")
+
+
+def _step_idx(entry) -> int:
+    return _name_idx(entry.name[5:])  # len("step_")
+
+
+def _job_idx(entry) -> int:
+    return _name_idx(entry.name[4:])  # len("job_")
+
 
 class DuplicateFilter(logging.Filter):
 
     def filter(self, record):
-        current_log = (record.module, record.levelno, record.msg)
+        # предупреждения и ошибки не подавляем: повтор сам по себе важен для истории работы
+        if record.levelno >= logging.WARNING:
+            return True
+        # сравниваем готовый текст, а не шаблон: при ленивом %-форматировании record.msg общий
+        current_log = (record.module, record.levelno, record.getMessage())
         if current_log != getattr(self, "last_log", None):
             self.last_log = current_log
             return True
@@ -127,6 +352,9 @@ class SlurmConfig():
         
         self.job_prefix = job_prefix
 
+        # шаблон подставляется сразу: ошибка в нём видна при старте, а не при первой отправке
+        render_task_script(self.sbatch_template)
+
 
 class CalypsoScheduler():
     def __init__(self,
@@ -138,6 +366,9 @@ class CalypsoScheduler():
                  slurm_config: SlurmConfig,
                  logger: Logger,
                  ml_train_until: int = 0,
+                 min_sleep_seconds: int = 5,
+                 max_sleep_seconds: int = 300,
+                 max_parallel_jobs: int = 1,
                  ):
         self.calypso_exe = calypso_exe.resolve()
         if not self.calypso_exe.is_file():
@@ -147,20 +378,29 @@ class CalypsoScheduler():
         if not self.calypso_workdir.is_dir():
             raise FileNotFoundError(f"Рабочая директория Calypso не найдена:\n{self.calypso_workdir}\n{calypso_workdir}")
         
+        with os.scandir(self.calypso_workdir) as entries:
+            calypso_files = {entry.name for entry in entries if entry.is_file()}
+
         calypso_infile = self.calypso_workdir / "input.dat"
-        if not calypso_infile.is_file():
+        if "input.dat" not in calypso_files:
             raise FileNotFoundError(f"Входной файл Calypso input.dat не найден в рабочей директории по пути:\n{calypso_infile}")
 
         self.input_dir = input_dir.resolve()
         if not self.input_dir.is_dir():
             raise FileNotFoundError(f"Директория входных файлов не найдена:\n{self.input_dir}\n{input_dir}")
         
+        # одно чтение директории вместо stat на POTCAR и glob по INCAR_*
+        with os.scandir(self.input_dir) as entries:
+            input_files = {entry.name for entry in entries if entry.is_file()}
+
+        self._has_potcar = "POTCAR" in input_files
+        self._incar_count = sum(1 for name in input_files if name.startswith("INCAR_"))
+
         potcar_file = self.input_dir / "POTCAR"
-        if not potcar_file.is_file():
+        if not self._has_potcar:
             raise FileNotFoundError(f"Файл POTCAR не найден в директории входных файлов по пути:\n{potcar_file}")
         
-        incar_files = list(self.input_dir.glob("INCAR_*"))
-        if not incar_files:
+        if self._incar_count == 0:
             raise FileNotFoundError(f"Не найдено ни одного файла INCAR_* в директории входных файлов:\n{self.input_dir}")
         
         self.tasks_dir = tasks_dir.resolve()
@@ -174,34 +414,128 @@ class CalypsoScheduler():
         self.task_slurm_status_filename = "slurm.json"
         self.task_job_prefix = "job_"
         self.ml_train_until = ml_train_until
-        self.loop_sleep_seconds = 300
+        if max_parallel_jobs < 1:
+            raise ValueError(f"Некорректное число параллельных задач: {max_parallel_jobs}")
+        self.max_parallel_jobs = max_parallel_jobs
+        if min_sleep_seconds <= 0 or max_sleep_seconds < min_sleep_seconds:
+            raise ValueError(f"Некорректные интервалы опроса: min={min_sleep_seconds}, max={max_sleep_seconds}")
+        self.loop_sleep_seconds = max_sleep_seconds
+        self.loop_min_sleep_seconds = min_sleep_seconds
+        self._poll_attempt = 0
+        self._last_job_status = None
+        self._generation_cache = None  # (ключ состояния Calypso, номер поколения)
+        self._poscars_cache = None     # (ключ состояния Calypso, список POSCAR_*)
+        self._completed_cache: Dict[str, Tuple[Tuple[int, int], bool]] = {}  # task_id -> ((mtime_ns, размер), вердикт)
+        self.slurm_status = SlurmStatusCache()
+        # запись step/POSCAR_* и status.json будит цикл раньше таймера (на NFS события
+        # с других узлов не приходят, поэтому таймер с backoff остаётся)
+        self.fs_watcher = InotifyWatcher()
+        self.fs_watcher.add(self.calypso_workdir)
         self.logger = logger
 
 
+    async def sleep_with_backoff(self):
+        delay = min(self.loop_sleep_seconds, self.loop_min_sleep_seconds * 2 ** self._poll_attempt)
+        if delay < self.loop_sleep_seconds:
+            self._poll_attempt += 1
+
+        self.logger.debug("Следующая проверка через %s с", delay)
+        if await self._wait_for_fs_event(delay):
+            self.logger.debug("Изменились файлы в отслеживаемых директориях, проверка раньше срока")
+
+
+    async def _wait_for_fs_event(self, timeout: float) -> bool:
+        if self.fs_watcher.fd is None:
+            await asyncio.sleep(timeout)
+            return False
+
+        # события, накопленные за прошлую итерацию (например, status.json записан во время
+        # копирования результатов), не выбрасываем: они будят цикл сразу
+        loop = asyncio.get_running_loop()
+        changed = asyncio.Event()
+        loop.add_reader(self.fs_watcher.fd, changed.set)
+        try:
+            await asyncio.wait_for(changed.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            loop.remove_reader(self.fs_watcher.fd)
+        # вычитываем только после пробуждения, чтобы одно изменение не будило цикл повторно
+        self.fs_watcher.drain()
+        return True
+
+
+    def reset_backoff(self):
+        self._poll_attempt = 0
+
+
+    def _calypso_state_key(self):
+        # step переписывается при каждом запуске Calypso, новые POSCAR_* меняют mtime директории
+        try:
+            step_mtime_ns = (self.calypso_workdir / "step").stat().st_mtime_ns
+        except FileNotFoundError:
+            step_mtime_ns = None
+        return (step_mtime_ns, self.calypso_workdir.stat().st_mtime_ns)
+
+
+    def _invalidate_calypso_cache(self):
+        self._generation_cache = None
+        self._poscars_cache = None
+
+
     def check_calypso_generation(self):
         step_file_path = self.calypso_workdir / "step"
 
-        self.logger.debug(f"Проверка поколения Calypso в файле {step_file_path}")
+        self.logger.debug("Проверка поколения Calypso в файле %s", step_file_path)
+
+        state_key = self._calypso_state_key()
+        if self._generation_cache is not None and self._generation_cache[0] == state_key:
+            return self._generation_cache[1]
 
         generation = None
-        if step_file_path.is_file():
+        if state_key[0] is not None:
             with open(step_file_path) as step_file:
                 generation = int(step_file.read()) - 1
         
+        self._generation_cache = (state_key, generation)
         return generation
 
 
-    def execute_calypso(self):
-        self.logger.debug(f"Запуск calypso {self.calypso_exe} в {self.calypso_workdir}")
+    async def execute_calypso(self):
+        self.logger.debug("Запуск calypso %s в %s", self.calypso_exe, self.calypso_workdir)
 
-        result = subprocess.run(str(self.calypso_exe), shell=True, cwd=self.calypso_workdir, executable='/bin/bash')
-        if result.returncode != 0:
-            raise CalypsoError(f"Ошибка выполнения calypso.x\nКод: {result.returncode}\nОшибка:\n{result.stderr}\nВывод:\n{result.stdout}")
+        # без промежуточного /bin/bash -c: путь известен, раскрытие шаблонов не нужно
+        proc = await asyncio.create_subprocess_exec(str(self.calypso_exe), cwd=str(self.calypso_workdir))
+        wait_task = asyncio.ensure_future(proc.wait())
+        while True:
+            try:
+                returncode = await asyncio.wait_for(asyncio.shield(wait_task), timeout=self.loop_sleep_seconds)
+                break
+            except asyncio.TimeoutError:
+                self.logger.debug("calypso.x (pid %s) ещё выполняется", proc.pid)
+        # Calypso только что переписала step и POSCAR_*: не полагаемся на разрешение mtime
+        self._invalidate_calypso_cache()
+        if returncode != 0:
+            raise CalypsoError(f"Ошибка выполнения calypso.x\nКод: {returncode}")
         return None
 
 
     def get_calypso_poscars(self):
-        generated_poscars = sorted(self.calypso_workdir.glob('POSCAR_*'), key=lambda x: int(x.name.split('_')[1]))
+        state_key = self._calypso_state_key()
+        if self._poscars_cache is None or self._poscars_cache[0] != state_key:
+            indexed_poscars = []
+            with os.scandir(self.calypso_workdir) as entries:
+                for entry in entries:
+                    if not entry.name.startswith("POSCAR_"):
+                        continue
+                    try:
+                        indexed_poscars.append((_poscar_idx(entry), entry.path))
+                    except ValueError:
+                        continue  # посторонние файлы вида POSCAR_old
+            indexed_poscars.sort()
+            self._poscars_cache = (state_key, [Path(path) for _, path in indexed_poscars])
+
+        generated_poscars = list(self._poscars_cache[1])
 
         if not generated_poscars:
             return None
@@ -223,8 +557,7 @@ class CalypsoScheduler():
         if not slurm_status_file.is_file():
             return None
         
-        with open(slurm_status_file, 'r') as f:
-            slurm_status: dict = json.load(f)
+        slurm_status: dict = load_json(slurm_status_file)
         
         if "current_id" in slurm_status.keys():
             return slurm_status["current_id"]
@@ -236,52 +569,72 @@ class CalypsoScheduler():
         task_folder = self.get_task_path_from_id(task_id)
         status_file_path = task_folder / self.task_status_filename
 
-        if not status_file_path.is_file():
+        # задачи массива (--single_job) пишут status_<N>.json; если шаг --reduce не запускали,
+        # сводим их сами, иначе поколение навсегда выглядело бы незавершённым
+        reduce_job_statuses(status_file_path)
+
+        try:
+            st = os.stat(status_file_path)
+        except FileNotFoundError:
             return False
+
+        # status.json переписывает только task.py: пока файл не менялся, вердикт тот же
+        state_key = (st.st_mtime_ns, st.st_size)
+        cached = self._completed_cache.get(task_id)
+        if cached is not None and cached[0] == state_key:
+            return cached[1]
+
+        status: dict = _load_json_cached(str(status_file_path), *state_key)
         
-        with open(status_file_path, 'r') as f:
-            status: dict = json.load(f)
-        
-        if not "jobs" in status.keys():
+        jobs = status.get("jobs")
+        if jobs is None:
             raise RuntimeError(f"Файл status.json {status_file_path} не имеет ключа 'jobs'")
 
         # NOTE: можно выполнять проверку и надёжнее
-        for poscar in status["jobs"].keys():
-            poscar_state: dict = status["jobs"][poscar]
-
-            if not "status" in poscar_state.keys():
-                raise RuntimeError(f"В файле status.json {status_file_path} для {poscar} нет ключа 'status'")
-            
-            poscar_status = poscar_state["status"]
-
-            if poscar_status != 'success':
-                return False
+        try:
+            completed = all(job["status"] == "success" for job in jobs.values())
+        except KeyError as e:
+            raise RuntimeError(f"В файле status.json {status_file_path} у задачи нет ключа 'status'") from e
 
-        return True
+        self._completed_cache[task_id] = (state_key, completed)
+        return completed
 
 
     def copy_output_from_task_from_id(self, task_id: str):
         task_folder = self.get_task_path_from_id(task_id)
 
-        for job_folder in task_folder.glob("job_*"):
-            if not job_folder.is_dir():
-                continue
+        # DirEntry.is_dir() берёт тип из readdir, без отдельного stat на каждую папку
+        job_folders: List[Tuple[str, Path]] = []
+        with os.scandir(task_folder) as entries:
+            for entry in entries:
+                if not entry.name.startswith("job_") or not entry.is_dir():
+                    continue
+                try:
+                    _job_idx(entry)
+                except ValueError:
+                    self.logger.warning("Не удалось извлечь номер из папки %s", entry.path)
+                    continue
+                job_folders.append((entry.name[len("job_"):], Path(entry.path)))
 
-            try:
-                job_number = job_folder.name.split("_")[1]
-            except IndexError:
-                self.logger.warning(f"Не удалось извлечь номер из папки {job_folder}")
-                continue
-            
-            step_folders = [folder for folder in job_folder.glob("step_*") if folder.is_dir()]
-            if not step_folders:
-                self.logger.warning(f"Нет подпапок 'step_*' в {job_folder}")
+        # пары (источник, назначение); сами копирования независимы и выполняются параллельно
+        copies: List[Tuple[Path, Path]] = []
+
+        for job_number, job_folder in job_folders:
+            # за один проход по директории держим текущий максимум
+            max_step_idx, max_step_folder = -1, None
+            with os.scandir(job_folder) as entries:
+                for entry in entries:
+                    if not entry.name.startswith("step_") or not entry.is_dir():
+                        continue
+                    try:
+                        step_idx = _step_idx(entry)
+                    except ValueError:
+                        continue
+                    if step_idx > max_step_idx:
+                        max_step_idx, max_step_folder = step_idx, Path(entry.path)
+            if max_step_folder is None:
+                self.logger.warning("Нет подпапок 'step_*' в %s", job_folder)
                 continue
-            
-            def extract_step_number(step_path: Path) -> int:
-                return int(step_path.name.split("_")[1])
-            
-            max_step_folder = max(step_folders, key=extract_step_number)
 
             target_outcar = self.calypso_workdir / f"OUTCAR_{job_number}"
             target_contcar = self.calypso_workdir / f"CONTCAR_{job_number}"
@@ -291,61 +644,57 @@ class CalypsoScheduler():
             if not poscar_source.exists():
                 raise FileNotFoundError(f"Файл {poscar_source} не найден")
 
-            self.logger.debug(f"{poscar_source} -> {target_poscar}")
-            shutil.copy(poscar_source, target_poscar)
+            self.logger.debug("%s -> %s", poscar_source, target_poscar)
+            copies.append((poscar_source, target_poscar))
 
             contcar_source = max_step_folder / "CONTCAR"
-            if not contcar_source.exists():
-                self.logger.error(f"Отсутствует файл CONTCAR: {contcar_source}, файл НЕ копируется")
+            try:
+                contcar_size = contcar_source.stat().st_size
+            except FileNotFoundError:
+                self.logger.error("Отсутствует файл CONTCAR: %s, файл НЕ копируется", contcar_source)
                 #continue
                 #raise FileNotFoundError(f"Файл {contcar_source} не найден")
             else:
-                with open(contcar_source, 'r') as file_obj:
-                    file_content = file_obj.read().strip()
-                    
-                    #if not file_content:
-                    #    self.logger.warning(f"Файл {contcar_source} пуст, пропускаю")
-                    #    continue
-                    #else:
-                    self.logger.debug(f"{contcar_source} -> {target_contcar}")
-                    shutil.copy(contcar_source, target_contcar)
+                if contcar_size == 0:
+                    self.logger.warning("Файл %s пуст", contcar_source)
+                self.logger.debug("%s -> %s", contcar_source, target_contcar)
+                copies.append((contcar_source, target_contcar))
             
             outcar_source = max_step_folder / "OUTCAR"
             if not outcar_source.exists():
                 raise FileNotFoundError(f"Файл {outcar_source} не найден")
             
-            self.logger.debug(f" {outcar_source} -> {target_outcar}")
-            shutil.copy(outcar_source, target_outcar)
+            self.logger.debug(" %s -> %s", outcar_source, target_outcar)
+            copies.append((outcar_source, target_outcar))
+
+        max_workers = min(32, (os.cpu_count() or 1) * 4, max(len(copies), 1))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # list() пробрасывает исключения из потоков
+            list(executor.map(lambda pair: fast_copy(*pair), copies))
 
         return None
 
 
     def submit_slurm_task_from_id(self, task_id: str, job_name: str) -> int:
-        self.logger.info(f"Запуск задания slurm для {task_id}")
+        self.logger.info("Запуск задания slurm для %s", task_id)
         task_path = self.get_task_path_from_id(task_id)
 
         slurm_id = submit_job(self.slurm_config.sbatch_template, task_path, f"{self.slurm_config.job_prefix}_{job_name}")
 
         self.update_slurm_id_from_id(task_id, str(slurm_id))
 
-        self.logger.info(f"Задание {task_id} с id {slurm_id} запущено, ожидаю завершения")
+        self.logger.info("Задание %s с id %s запущено, ожидаю завершения", task_id, slurm_id)
         return slurm_id
     
 
     def update_slurm_id_from_id(self, task_id: str, slurm_id: str) -> None:
-        task_path = self.get_task_path_from_id(task_id)
-        slurm_status_file = task_path / "slurm.json"
+        slurm_status_file = self.get_task_slurm_statusfile_from_id(task_id)
 
-        if slurm_status_file.is_file():
-            with open(slurm_status_file, 'r') as f:
-                slurm_config = json.load(f)
-            
-            slurm_config["current_id"] = slurm_id
-        else:
-            slurm_config = {"current_id": slurm_id}
+        # прежнее содержимое не нужно: файл хранит только current_id
+        _atomic_write_json(slurm_status_file, {"current_id": slurm_id})
 
-        with open(slurm_status_file, 'w') as f:
-            json.dump({ "current_id": slurm_id}, f)
+        # при грубом разрешении mtime новый id мог бы попасть под старый ключ кэша
+        _load_json_cached.cache_clear()
 
 
     def prepare_task_from_poscars(self, 
@@ -357,14 +706,19 @@ class CalypsoScheduler():
         task_path = self.get_task_path_from_id(task_id)
         task_poscars_path = task_path / self.task_poscars_subfolder_name
 
-        self.logger.debug(f"Подготавливается задача {task_id} в {task_path}")
+        self.logger.debug("Подготавливается задача %s в %s", task_id, task_path)
 
         task_poscars_path.mkdir(parents=True, exist_ok=True)
 
-        for poscar_file in poscars:
-            self.logger.debug(f"{poscar_file} -> {task_poscars_path}")
+        if self.logger.isEnabledFor(logging.DEBUG):
+            for poscar_file in poscars:
+                self.logger.debug("%s -> %s", poscar_file, task_poscars_path)
 
-            shutil.copy(poscar_file, task_poscars_path)
+        # мелкие файлы на NFS упираются в задержку, а не в полосу: перекрываем копирования
+        max_workers = min(32, max(len(poscars), 1))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            list(executor.map(lambda poscar_file: fast_copy(poscar_file, task_poscars_path / poscar_file.name),
+                              poscars))
         
         task_config = {
             "input_dir": str(self.input_dir),
@@ -372,37 +726,37 @@ class CalypsoScheduler():
             "global_work_dir": str(task_path),
             "vasp_cmd": self.vasp_cmd,
             "status_file": str(task_path / self.task_status_filename),
-            "job_prefix": self.task_job_prefix
+            "job_prefix": self.task_job_prefix,
+            "max_parallel_jobs": self.max_parallel_jobs,
         }
 
         if ml_train:
-            self.logger.debug(f"Планировщик активирует обучение для задачи {task_id}")
+            self.logger.debug("Планировщик активирует обучение для задачи %s", task_id)
             task_config["ml_train"] = "enable"
         
         if ml_refit:
-            self.logger.debug(f"Планировщик активирует переобучение для задачи {task_id}")
+            self.logger.debug("Планировщик активирует переобучение для задачи %s", task_id)
             task_config["ml_refit"] = "enable"
         
         if ml_predict:
-            self.logger.debug(f"Планировщик активирует предсказание для задачи {task_id}")
+            self.logger.debug("Планировщик активирует предсказание для задачи %s", task_id)
             task_config["ml_predict"] = "enable"
 
 
         task_config_file_path = task_path / self.task_config_filename
 
-        self.logger.debug(f"Подготовка конфигурационного файла задачи {task_id} по пути {task_config_file_path}")
-        with open(task_config_file_path, mode="w", encoding="utf-8") as task_config_file:
-            json.dump(task_config, task_config_file)
+        self.logger.debug("Подготовка конфигурационного файла задачи %s по пути %s", task_id, task_config_file_path)
+        _atomic_write_json(task_config_file_path, task_config)
 
-        self.logger.debug(f"Подготовлена задача {task_id} в {task_path}")
+        self.logger.debug("Подготовлена задача %s в %s", task_id, task_path)
         return task_path
 
 
-    def run(self):
-        self.logger.info(f"Запуск основного цикла")
+    async def run(self):
+        self.logger.info("Запуск основного цикла")
 
         while True:
-            self.logger.debug(f"Проверка, не завершена ли уже работа с текущим поколением")
+            self.logger.debug("Проверка, не завершена ли уже работа с текущим поколением")
 
             current_generation_number = self.check_calypso_generation()
             if current_generation_number is not None:
@@ -410,51 +764,67 @@ class CalypsoScheduler():
 
                 possible_current_task_config = possible_current_task_path / self.task_config_filename
                 if possible_current_task_config.is_file():
-                    self.logger.debug(f"Задание slurm для поколения {str(current_generation_number)} уже существует по пути {possible_current_task_path}")
+                    self.fs_watcher.add(possible_current_task_path)
+                    self.logger.debug("Задание slurm для поколения %s уже существует по пути %s", current_generation_number, possible_current_task_path)
                     
                     slurm_id = self.get_current_slurm_id_from_id(current_generation_number)
 
                     if slurm_id is None:
-                        self.submit_slurm_task_from_id(current_generation_number, str(current_generation_number))
-                        time.sleep(self.loop_sleep_seconds)
+                        self.reset_backoff()
+                        await _run_blocking(self.submit_slurm_task_from_id, current_generation_number, str(current_generation_number))
+                        await self.sleep_with_backoff()
                         continue
 
-                    job_status = get_job_status(slurm_id)
+                    await self.slurm_status.refresh_async([slurm_id])
+                    job_status = self.slurm_status.get(slurm_id)
+
+                    if job_status != self._last_job_status:
+                        # задание только что стартовало: снова опрашиваем часто.
+                        # На переходы в завершённые состояния не сбрасываем, чтобы
+                        # быстро падающее задание не перезапускалось каждые несколько секунд
+                        if job_status == "RUNNING":
+                            self.reset_backoff()
+                        self._last_job_status = job_status
 
                     if job_status == "PENDING" or job_status == "RUNNING":
-                        self.logger.info(f"Задание slurm {slurm_id} для поколения {current_generation_number} в состоянии {job_status}, ожидаю")
-                        time.sleep(self.loop_sleep_seconds)
+                        self.logger.info("Задание slurm %s для поколения %s в состоянии %s, ожидаю", slurm_id, current_generation_number, job_status)
+                        await self.sleep_with_backoff()
                         continue
                     elif not self.check_if_all_task_job_completed_from_id(str(current_generation_number)):
                         # NOTE: лучше бы проверить детально наличие всех нужных файлов и соответствие количеств POSCAR_*
-                        self.logger.warning(f"Задание slurm для поколения {current_generation_number} завершились не полностью или с ошибками")
-                        self.submit_slurm_task_from_id(current_generation_number, f"{current_generation_number}R")
-                        time.sleep(self.loop_sleep_seconds)
+                        self.logger.warning("Задание slurm для поколения %s завершились не полностью или с ошибками", current_generation_number)
+                        await _run_blocking(self.submit_slurm_task_from_id, current_generation_number, f"{current_generation_number}R")
+                        await self.sleep_with_backoff()
                         continue
 
-                    self.logger.debug(f"Копирую выходые файлы расчётов в папку Calypso")
-                    self.copy_output_from_task_from_id(str(current_generation_number))
+                    self.logger.debug("Копирую выходые файлы расчётов в папку Calypso")
+                    await _run_blocking(self.copy_output_from_task_from_id, str(current_generation_number))
+                    # задача поколения завершена, наблюдать её директорию больше незачем
+                    self.fs_watcher.remove(possible_current_task_path)
                 else:
-                    self.logger.info(f"Подготовка задния для поколения {current_generation_number}")
+                    self.logger.info("Подготовка задния для поколения %s", current_generation_number)
                     poscars = self.get_calypso_poscars()
 
-                    task_path = self.prepare_task_from_poscars(poscars=poscars, 
-                                                               task_id=str(current_generation_number),
-                                                               ml_train=current_generation_number < self.ml_train_until,
-                                                               ml_refit=current_generation_number == self.ml_train_until,
-                                                               ml_predict=current_generation_number > self.ml_train_until,
-                                                               # TODO: включить refit/predict по триггеру
-                                                               )
-                    self.logger.info(f"Подготовлено задание в {str(task_path)}")
+                    prepare = functools.partial(self.prepare_task_from_poscars,
+                                                poscars=poscars, 
+                                                task_id=str(current_generation_number),
+                                                ml_train=current_generation_number < self.ml_train_until,
+                                                ml_refit=current_generation_number == self.ml_train_until,
+                                                ml_predict=current_generation_number > self.ml_train_until,
+                                                # TODO: включить refit/predict по триггеру
+                                                )
+                    task_path = await _run_blocking(prepare)
+                    self.logger.info("Подготовлено задание в %s", task_path)
                     continue
 
             self.logger.info("Запуск Calypso")
-            self.execute_calypso()
+            self.reset_backoff()
+            await self.execute_calypso()
             poscars = self.get_calypso_poscars()
             updated_generation_number = self.check_calypso_generation()
 
             if not poscars:
-                self.logger.info(f"Calypso корректно завершила работу, но не сгенерировала POSCAR_*. Работа завершена.")
+                self.logger.info("Calypso корректно завершила работу, но не сгенерировала POSCAR_*. Работа завершена.")
                 return None
             
             if updated_generation_number is None:
@@ -492,6 +862,17 @@ def main():
     parser.add_argument("--log_file", required=False,
                         default="./scheduler.log",
                         help="Путь к файлу лога")
+    parser.add_argument("--min_sleep", required=False,
+                        type=int, default=5,
+                        help="Начальный интервал (с) между проверками состояния задания Slurm;\
+                            при неизменном состоянии интервал удваивается до --max_sleep")
+    parser.add_argument("--max_sleep", required=False,
+                        type=int, default=300,
+                        help="Максимальный интервал (с) между проверками состояния задания Slurm")
+    parser.add_argument("--max_parallel_jobs", required=False,
+                        type=int, default=1,
+                        help="Сколько структур внутри одного задания Slurm рассчитывать одновременно;\
+                            действует только без машинного обучения, где структуры независимы")
     parser.add_argument("--ml_train_until", required=False,
                         help="Поколения с 1 (включительно) до указанного будут использованы для обучения VASP ML FF,\
                             затем на указанном поколении будет произведён refit и\
@@ -516,7 +897,7 @@ def main():
     ml_train_until = 0
     if not args.ml_train_until is None:
         ml_train_until = int(args.ml_train_until)
-        logger.info(f"Подключено машинное обучение VASP до итерации {args.ml_train_until}")
+        logger.info("Подключено машинное обучение VASP до итерации %s", args.ml_train_until)
 
     console_formatter = logging.Formatter('[%(asctime)s] %(message)s', 
                                         datefmt='%Y-%m-%d %H:%M:%S')
@@ -539,9 +920,12 @@ def main():
         slurm_config=slurm_config,
         logger=logger,
         ml_train_until=ml_train_until,
+        min_sleep_seconds=args.min_sleep,
+        max_sleep_seconds=args.max_sleep,
+        max_parallel_jobs=args.max_parallel_jobs,
     )
 
-    scheduler.run()
+    asyncio.run(scheduler.run())
     return None
 
 
@@ -1,26 +1,178 @@
 #!/usr/bin/env python3
 
 import sys
-import math
+import atexit
+import functools
+import selectors
+import signal
 import json
 import logging
 import argparse
 import subprocess
 import re
-import shutil
 from pathlib import Path
 from datetime import datetime
 from incar import IncarFile
-import threading
+from utils import fast_copy, prefetch
+from concurrent.futures import as_completed
 import time
 import os
-import sys
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# листинг уже отбирает имена с нужным префиксом, поэтому хватает match() от начала строки
+_INCAR_RE = re.compile(r'INCAR_(\d+)')
+_ML_AB_RE = re.compile(r'ML_AB_(\d+)')
+_ML_FF_RE = re.compile(r'ML_FF_(\d+)')
+_POSCAR_RE = re.compile(r'POSCAR_(\d+)')
+_INDEX_RE = {"INCAR": _INCAR_RE, "ML_AB": _ML_AB_RE, "ML_FF": _ML_FF_RE, "POSCAR": _POSCAR_RE}
+
+
+def _suffix(regex, path: Path) -> str:
+    # не rsplit('_'): у INCAR после номера может идти пометка, например INCAR_3_SCF
+    return regex.match(path.name).group(1)
+
+
+def _list_prefixes(dirpath: Path, prefixes: tuple) -> list:
+    # один проход readdir со startswith вместо fnmatch из Path.glob; тип файла берётся из dirent
+    found = [[] for _ in prefixes]
+    with os.scandir(dirpath) as entries:
+        for entry in entries:
+            for group, prefix in zip(found, prefixes):
+                if entry.name.startswith(prefix):
+                    if entry.is_file():
+                        group.append(Path(entry.path))
+                    break
+    return found
+
+
+def _list_prefix(dirpath: Path, prefix: str) -> list:
+    return _list_prefixes(dirpath, (prefix,))[0]
+
+
+def _sorted_by_index(paths, regex):
+    # ключ считается по разу на файл, а не на каждое сравнение
+    return sorted(paths, key=lambda path: int(_suffix(regex, path)))
+
+
+@functools.lru_cache(maxsize=32)
+def _list_sorted(dirpath: str, prefixes: tuple, mtime_ns: int) -> tuple:
+    # mtime_ns директории в ключе: добавление/удаление файлов сбрасывает кэш
+    groups = _list_prefixes(dirpath, tuple(f"{prefix}_" for prefix in prefixes))
+    return tuple(tuple(_sorted_by_index(group, _INDEX_RE[prefix])) for group, prefix in zip(groups, prefixes))
+
+
+def _list_input(dirpath: Path, *prefixes: str) -> list:
+    """
+    Файлы PREFIX_<N> из директории по возрастанию N, по списку на каждый префикс;
+    директория читается один раз, листинг общий для всех задач процесса.
+    """
+    return [list(group) for group in _list_sorted(str(dirpath), prefixes, dirpath.stat().st_mtime_ns)]
+
+
+@functools.lru_cache(maxsize=32)
+def _is_file_cached(path: str, dir_mtime_ns: int) -> bool:
+    return os.path.isfile(path)
 
 
 class VaspExecutionError(Exception):
     pass
 
 
+_PIPE_CHUNK = 64 * 1024
+
+
+def _pump_log(process: subprocess.Popen, log_fd: int, check_bytes: bytes = None, deadline: float = None) -> bool:
+    """
+    Переписывает вывод процесса в лог блоками по 64 КиБ, пока не встретится check_bytes,
+    не закончится вывод или не наступит deadline (time.monotonic()).
+    False — только если наступил deadline.
+    """
+    fd = process.stdout.fileno()
+    tail = b""  # строка может прийти разрезанной между двумя блоками
+    with selectors.DefaultSelector() as selector:
+        selector.register(fd, selectors.EVENT_READ)
+        while True:
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not selector.select(remaining):
+                    return False
+
+            data = os.read(fd, _PIPE_CHUNK)
+            if not data:
+                return True
+
+            view = memoryview(data)
+            while view:
+                view = view[os.write(log_fd, view):]
+
+            if check_bytes is not None:
+                if check_bytes in tail + data:
+                    return True
+                tail = data[-len(check_bytes):]
+
+
+def _stage(src: Path, dst: Path, symlink_first: bool = False, symlink_target: str = None) -> str:
+    """
+    Размещает входной файл этапа без копирования данных: жёсткая ссылка,
+    при другой ФС — символьная (на symlink_target, если задан), в крайнем случае обычная копия.
+    Возвращает способ, которым файл размещён.
+    """
+    # повторный запуск: ссылка уже ведёт на тот же inode, размещать заново незачем
+    try:
+        if os.path.samestat(os.stat(dst), os.stat(src)):
+            return "уже размещён"
+    except FileNotFoundError:
+        pass
+
+    # старый файл/ссылка мешают os.link/os.symlink
+    try:
+        dst.unlink()
+    except FileNotFoundError:
+        pass
+
+    if not symlink_first:
+        try:
+            os.link(src, dst)
+            return "жёсткая ссылка"
+        except OSError:
+            pass
+
+    try:
+        os.symlink(symlink_target or src.resolve(), dst)
+        return "символьная ссылка"
+    except OSError:
+        pass
+
+    fast_copy(src, dst)
+    return "копия"
+
+
+def _export(src: Path, dst: Path) -> None:
+    """Копирует выходной файл в отдельный inode; старый dst может быть ссылкой на чужой файл."""
+    try:
+        dst.unlink()
+    except FileNotFoundError:
+        pass
+    fast_copy(src, dst)
+
+
+# режимы МО по порядку применения: флаг VaspJob, входные файлы по приоритету, имя в этапе, ML_MODE
+_ML_RULES = (
+    ("ml_train", ("ML_ABN", "ML_AB"), "ML_AB", "train"),
+    ("ml_refit", ("ML_ABN", "ML_AB"), "ML_AB", "refit"),
+    ("ml_predict", ("ML_FF", "ML_FFN"), "ML_FF", "run"),
+)
+
+
+def _absolute(path: Path) -> Path:
+    return path if path.is_absolute() else path.resolve()
+
+
 class VaspJob:
     def __init__(self,
                  workdir: Path,
@@ -36,26 +188,24 @@ class VaspJob:
                  ):
         self.logger = logger
         self.task_cmd = task_cmd
-        self.workdir = workdir.resolve()
-        self.inputdir = inputdir.resolve()
-        self.initial_structure_filepath = initial_structure_filepath.resolve()
+        # main() передаёт уже разрешённые пути, повторный resolve() — лишние lstat на каждый компонент
+        self.workdir = _absolute(workdir)
+        self.inputdir = _absolute(inputdir)
+        self.initial_structure_filepath = _absolute(initial_structure_filepath)
 
 
         if not self.initial_structure_filepath.is_file():
             raise FileNotFoundError(f"Начальный файл структуры не найден: {self.initial_structure_filepath}")
         potcar_path = self.inputdir / "POTCAR"
-        if not potcar_path.is_file():
+        if not _is_file_cached(str(potcar_path), self.inputdir.stat().st_mtime_ns):
             raise FileNotFoundError(f"Файл POTCAR не найден в {self.inputdir}")
 
-        self.incar_files = sorted(
-            self.inputdir.glob("INCAR_*"),
-            key=lambda f: int(re.search(r'INCAR_(\d+)', f.name).group(1))
-        )
+        self.incar_files, = _list_input(self.inputdir, "INCAR")
         if not self.incar_files:
             raise FileNotFoundError(f"Не найдено ни одного файла INCAR_* в {self.inputdir}")
         
         if ml_predict and (ml_train or ml_refit):
-            self.logger.warning(f"Конфликт: одновременно активны флаг ml_predict и ml_train/ml_refit; все функции МО отключены")
+            self.logger.warning("Конфликт: одновременно активны флаг ml_predict и ml_train/ml_refit; все функции МО отключены")
 
             self.ml_train = False
             self.ml_refit = False
@@ -66,8 +216,8 @@ class VaspJob:
             self.ml_predict = ml_predict
 
 
-        self.ml_input = ml_input.resolve() if ml_input is not None else None
-        self.ml_output = ml_output.resolve() if ml_output is not None else None
+        self.ml_input = _absolute(ml_input) if ml_input is not None else None
+        self.ml_output = _absolute(ml_output) if ml_output is not None else None
 
         if self.ml_output is not None:
             self.ml_output.mkdir(parents=True, exist_ok=True)
@@ -76,28 +226,26 @@ class VaspJob:
         self.ml_ff_files = []
 
         if self.ml_input is not None and self.ml_input.exists():
-            self.ml_ab_files = sorted(
-                self.ml_input.glob("ML_AB_*"),
-                key=lambda f: int(re.search(r'ML_AB_(\d+)', f.name).group(1))
-            )
-            self.ml_ff_files = sorted(
-                self.ml_input.glob("ML_FF_*"),
-                key=lambda f: int(re.search(r'ML_FF_(\d+)', f.name).group(1))
-            )
+            self.ml_ab_files, self.ml_ff_files = _list_input(self.ml_input, "ML_AB", "ML_FF")
         else:
-            self.logger.warning(f"Директория входных файлов для MLFF {str(self.ml_input)} не задана или не существует")
+            self.logger.warning("Директория входных файлов для MLFF %s не задана или не существует", self.ml_input)
 
 
         self.workdir.mkdir(parents=True, exist_ok=True)
-        self.logger.info(f"Рабочая директория задачи: {self.workdir}")
+        self.logger.info("Рабочая директория задачи: %s", self.workdir)
 
         self.poscar_original = self.workdir / "POSCAR_ORIGINAL"
-        shutil.copy(self.initial_structure_filepath, self.poscar_original)
-        self.logger.info(f"Скопирован исходный файл структуры в {self.poscar_original}")
+        method = _stage(self.initial_structure_filepath, self.poscar_original)
+        self.logger.info("Исходный файл структуры размещён в %s (%s)", self.poscar_original, method)
+
+        # POTCAR один на все этапы: кладём его в корень задачи, этапы ссылаются на ../POTCAR
+        self.potcar = self.workdir / "POTCAR"
+        method = _stage(potcar_path, self.potcar)
+        self.logger.info("POTCAR размещён в %s (%s)", self.potcar, method)
 
 
     def configure_incar_for_ml(self) -> None:
-        self.logger.debug(f"Конфигурирую INCAR для включения MLFF")
+        self.logger.debug("Конфигурирую INCAR для включения MLFF")
         return None
     
 
@@ -112,178 +260,161 @@ class VaspJob:
         ml_enabled = incar_file.get("ML_LMLFF", False)
 
         if ml_enabled:
-            self.logger.info(f"Машинное обучение подключено, наблюдаю за ходом задачи...")
+            self.logger.info("Машинное обучение подключено, наблюдаю за ходом задачи...")
+
+        # лог VASP пишется байтами как есть: декодировать его в str незачем
+        check_bytes = check_string.encode()
+
+        # лог открывается один раз на дозапись: вывод прошлых попыток и запусков не теряется
+        with open(log_file_path, "ab", buffering=0) as logfile:
+            for i in range(3):
+                self.logger.info("Запуск '%s' в cwd=%s, попытка %s", cmd, cwd, i)
+                logfile.write(f"=== попытка {i}, {datetime.now().isoformat()} ===\n".encode())
+                if not ml_enabled:
+                    # без МО вывод читать не нужно: ядро пишет его прямо в файл лога
+                    process = subprocess.Popen(cmd,
+                                               stdout=logfile,
+                                               stderr=subprocess.STDOUT,
+                                               cwd=cwd)
+                    self.logger.info("Ожидаю задачу...")
+                    return process.wait()
 
-        for i in range(3):
-            self.logger.info(f"Запуск '{cmd}' в cwd={cwd}, попытка {i}")
-            with open(log_file_path, "w") as logfile:
                 process = subprocess.Popen(cmd,
                                         stdout=subprocess.PIPE,
                                         stderr=subprocess.STDOUT,
-                                        text=True,
-                                        cwd=cwd,
-                                        bufsize=1,
-                                        universal_newlines=True)
+                                        cwd=cwd)
+
+                # вывод читается в том же потоке: ожидание строки и таймаут в одном цикле select
+                if _pump_log(process, logfile.fileno(), check_bytes, time.monotonic() + timeout):
+                    if process.poll() is None:
+                        self.logger.info("Строка '%s' найдена, ожидаю завершения задачи...", check_string)
+                    _pump_log(process, logfile.fileno())
+                    return process.wait()
+
+                self.logger.warning("Таймаут %sс достигнут, отключение МО и переход задачи в нестандартный режим...", timeout)
+                incar_file.update({}, ["ML_LMLFF", "ML_MODE"])
+                open(cwd / "CUSTOM", 'a').close()
+                self.logger.warning("Завершаю работу задания до дальнеёшего перезапуска планировщиком!")
+
+                current_job_slurm_id = os.environ['SLURM_JOB_ID']
+
+                if current_job_slurm_id is None:
+                    raise Exception(f"Не удалось определить slurm id: не задана переменная окружения SLURM_JOB_ID")
+
+                self.logger.warning("Пытаюсь завершить задание %s...", current_job_slurm_id)
+                params = ["scancel", current_job_slurm_id]
+                subprocess.run(
+                    params,
+                    capture_output=True, 
+                    text=True, 
+                    check=True,
+                    cwd=cwd,
+                )
+
+                sys.exit(1)
+
+                #process.terminate()
+                #process.kill()
+                #thread.join(10)
+                #process.wait() 
+                # NOTE: какой безобразный ужас...
+                break 
+                
+                    
 
-                start_time = time.time()
-                found_check_string = False
 
-                def reader():
-                    nonlocal found_check_string
-                    for line in process.stdout:
-                        logfile.write(line)
-                        if check_string in line:
-                            found_check_string = True
-                        logfile.flush()
+    def stage_step_inputs(self, i: int, step_dir: Path, incar_file: Path) -> None:
+        """Размещает INCAR, POTCAR и POSCAR этапа."""
+        incar_dest = step_dir / "INCAR"
+        potcar_dest = step_dir / "POTCAR"
+        poscar_dest = step_dir / "POSCAR"
 
-                thread = threading.Thread(target=reader)
-                thread.start()
+        if i == 1:
+            poscar_src = self.poscar_original
+            poscar_symlink_first = False
+        else:
+            poscar_src = self.workdir / f"step_{i-1}" / "CONTCAR"
+            if not poscar_src.is_file():
+                error_message = f"Этап {i}: Не найден CONTCAR в предыдущем этапе ({poscar_src})"
+                self.logger.error(error_message)
+                raise FileNotFoundError(error_message)
+            # символьная ссылка сохраняет видимой, из какого этапа взята структура
+            poscar_symlink_first = True
 
-                if not ml_enabled:
-                    self.logger.info(f"Ожидаю задачу...")
-                    returncode = process.wait()
-                    thread.join()
-                    return returncode
-
-
-                while True:
-                    time.sleep(5)
-                    elapsed = time.time() - start_time
-
-                    if process.poll() is not None:
-                        thread.join()
-                        return process.returncode
-
-                    if elapsed > timeout and not found_check_string:
-                        self.logger.warning(f"Таймаут {timeout}с достигнут, отключение МО и переход задачи в нестандартный режим...")
-                        incar_file.delete("ML_LMLFF")
-                        incar_file.delete("ML_MODE")
-                        open(cwd / "CUSTOM", 'a').close()
-                        self.logger.warning(f"Завершаю работу задания до дальнеёшего перезапуска планировщиком!")
-
-                        current_job_slurm_id = os.environ['SLURM_JOB_ID']
-
-                        if current_job_slurm_id is None:
-                            raise Exception(f"Не удалось определить slurm id: не задана переменная окружения SLURM_JOB_ID")
-
-                        self.logger.warning(f"Пытаюсь завершить задание {current_job_slurm_id}...")
-                        params = ["scancel", current_job_slurm_id]
-                        subprocess.run(
-                            params,
-                            capture_output=True, 
-                            text=True, 
-                            check=True,
-                            cwd=cwd,
-                        )
-
-                        sys.exit(1)
-
-                        #process.terminate()
-                        #process.kill()
-                        #thread.join(10)
-                        #process.wait() 
-                        # NOTE: какой безобразный ужас...
-                        break 
-                
-                    
+        # VASP только читает POTCAR и POSCAR, поэтому ссылки безопасны
+        potcar_method = _stage(self.potcar, potcar_dest, symlink_first=True, symlink_target="../POTCAR")
+
+        # INCAR копируется: пользователь может править его на месте (sed -i, >>, редактор),
+        # и через жёсткую ссылку правка ушла бы в общий INCAR_N всех следующих заданий
+        _export(incar_file, incar_dest)
+        incar_method = "копия"
+        poscar_method = _stage(poscar_src, poscar_dest, symlink_first=poscar_symlink_first)
+
+        self.logger.info("Этап %s: %s размещён в %s (%s)", i, incar_file.name, incar_dest, incar_method)
+        self.logger.info("Этап %s: POTCAR размещён в %s (%s)", i, potcar_dest, potcar_method)
+        self.logger.info("Этап %s: %s размещён в %s (%s)", i, poscar_src, poscar_dest, poscar_method)
 
 
     def run(self) -> None:
         for i, incar_file in enumerate(self.incar_files, start=1):
             step_dir = self.workdir / f"step_{i}"
             step_dir.mkdir(parents=True, exist_ok=True)
-            self.logger.info(f"Создана директория для этапа {i}: {step_dir}")
+            self.logger.info("Создана директория для этапа %s: %s", i, step_dir)
 
             custom_dest = step_dir / "CUSTOM"
             incar_name = incar_file.name
             incar_dest = step_dir / "INCAR"
 
-            if "SCF" in incar_file.name:
-                self.logger.info(f"Этап {incar_file.name} выполняется БЕЗ машинного обучения.")
-
-            if not custom_dest.is_file():
-                shutil.copy(incar_file, incar_dest)
-                self.logger.info(f"Этап {i}: {incar_file.name} скопирован в {incar_dest}")
-
-                incar_file = IncarFile(incar_dest)
-                ml_ab  = self.ml_input / f"ML_AB_{i}"
-                ml_abn = self.ml_input / f"ML_ABN_{i}"
-                ml_ab_target = step_dir / "ML_AB"
-                ml_ff_target = step_dir / "ML_FF"
-
-                if self.ml_train and not "SCF" in incar_name:
-                    if ml_abn.is_file():
-                        self.logger.debug(f"{ml_abn} -> {ml_ab_target}")
-                        shutil.copy(ml_abn, ml_ab_target)
-                    elif ml_ab.is_file():
-                        self.logger.debug(f"{ml_ab} -> {ml_ab_target}")
-                        shutil.copy(ml_ab, ml_ab_target)
-                    else:
-                        self.logger.warning(f"Нет входного файла ML_ABN_{i}/ML_AB_{i}, начинаем с нуля")
-                    
-                    incar_file.set("ML_LMLFF", True)
-                    incar_file.set("ML_MODE", "train")
-                    # NOTE: не забыть добавить параметр, увеличивающий колво референсных структур
-
-                if self.ml_refit and not "SCF" in incar_name:
-                    if ml_abn.is_file():
-                        self.logger.debug(f"{ml_abn} -> {ml_ab_target}")
-                        shutil.copy(ml_abn, ml_ab_target)
-                    elif ml_ab.is_file():
-                        self.logger.debug(f"{ml_ab} -> {ml_ab_target}")
-                        shutil.copy(ml_ab, ml_ab_target)
-                    
-                    if ml_abn.is_file() or ml_ab.is_file():
-                        incar_file.set("ML_LMLFF", True)
-                        incar_file.set("ML_MODE", "refit")
+            ml_step = "SCF" not in incar_name
+            if not ml_step:
+                self.logger.info("Этап %s выполняется БЕЗ машинного обучения.", incar_file.name)
+
+            custom = custom_dest.is_file()
+            if not custom:
+                self.stage_step_inputs(i, step_dir, incar_file)
+            # один экземпляр на этап: правки МО и monitor_and_restart работают с ним же
+            incar = IncarFile(incar_dest)
+
+            if not custom:
+                # один листинг ml_input на этап вместо stat() на каждую проверку кандидатов
+                ml_names = set()
+                if (self.ml_train or self.ml_refit or self.ml_predict) and ml_step:
+                    try:
+                        ml_names = set(os.listdir(self.ml_input))
+                    except FileNotFoundError:
+                        pass
+
+                for flag, candidates, target, mode in _ML_RULES:
+                    if not (getattr(self, flag) and ml_step):
+                        continue
+                    # кандидаты по приоритету: берём первый существующий
+                    src_name = next((f"{name}_{i}" for name in candidates if f"{name}_{i}" in ml_names), None)
+                    if src_name is not None:
+                        self.logger.debug("%s -> %s", self.ml_input / src_name, step_dir / target)
+                        _stage(self.ml_input / src_name, step_dir / target)
+                        # ML_AB/ML_FF бывают большими: readahead идёт, пока готовится запуск VASP
+                        prefetch(step_dir / target)
+                        incar.update({"ML_LMLFF": True, "ML_MODE": mode})
+                        continue
+
+                    missing = "/".join(f"{name}_{i}" for name in candidates)
+                    if flag == "ml_train":
+                        # NOTE: не забыть добавить параметр, увеличивающий колво референсных структур
+                        self.logger.warning("Нет входного файла %s, начинаем с нуля", missing)
+                        incar.update({"ML_LMLFF": True, "ML_MODE": mode})
                     else:
-                        self.logger.warning(f"Нет входного файла ML_ABN_{i}/ML_AB_{i}, этап refit для INCAR_{i} пропущен")
-                        incar_file.set("ML_LMLFF", False)
-
-                if self.ml_predict and not "SCF" in incar_name:
-                    ml_ff  = self.ml_input / f"ML_FF_{i}"
-                    ml_ffn  = self.ml_input / f"ML_FFN_{i}"
-
-                    if ml_ff.is_file():
-                        self.logger.debug(f"{ml_ff} -> {ml_ff_target}")
-                        shutil.copy(ml_ff, ml_ff_target)
-                    elif ml_ffn.is_file():
-                        self.logger.debug(f"{ml_ffn} -> {ml_ff_target}")
-                        shutil.copy(ml_ffn, ml_ff_target)
-                    
-                    if ml_ff.is_file() or ml_ffn.is_file():
-                        incar_file.set("ML_LMLFF", True)
-                        incar_file.set("ML_MODE", "run")
-                    else:
-                        self.logger.warning(f"Нет входного файла ML_FFN_{i}/ML_FF_{i}, этап predict для INCAR_{i} пропущен")
-
-                potcar_src = self.inputdir / "POTCAR"
-                potcar_dest = step_dir / "POTCAR"
-                shutil.copy(potcar_src, potcar_dest)
-                self.logger.info(f"Этап {i}: POTCAR скопирован в {potcar_dest}")
-
-                poscar_dest = step_dir / "POSCAR"
-                if i == 1:
-                    shutil.copy(self.poscar_original, poscar_dest)
-                    self.logger.info(f"Этап {i}: POSCAR_ORIGINAL скопирован в {poscar_dest}")
-                else:
-                    prev_step_dir = self.workdir / f"step_{i-1}"
-                    prev_contcar = prev_step_dir / "CONTCAR"
-                    if not prev_contcar.is_file():
-                        error_message = f"Этап {i}: Не найден CONTCAR в предыдущем этапе ({prev_contcar})"
-                        self.logger.error(error_message)
-                        raise FileNotFoundError(error_message)
-                    shutil.copy(prev_contcar, poscar_dest)
-                    self.logger.info(f"Этап {i}: CONTCAR из {prev_contcar} скопирован в {poscar_dest}")
+                        self.logger.warning("Нет входного файла %s, этап %s для INCAR_%s пропущен", missing, flag[3:], i)
+                        if flag == "ml_refit":
+                            incar.set("ML_LMLFF", False)
 
             log_file_path = step_dir / f"vasp_step_{i}.log"
 
-            self.logger.info(f"Этап {i}: запуск команды '{self.task_cmd}' с cwd={step_dir}")
+            self.logger.info("Этап %s: запуск команды '%s' с cwd=%s", i, self.task_cmd, step_dir)
             returncode = self.monitor_and_restart(
                 self.task_cmd,
                 log_file_path,
                 step_dir,
-                IncarFile(incar_dest),
+                incar,
                 300,
             )
             
@@ -293,7 +424,7 @@ class VaspJob:
 
                 raise VaspExecutionError(error_message)
             else:
-                self.logger.info(f"Этап {i} завершён успешно")
+                self.logger.info("Этап %s завершён успешно", i)
             
             outcar_file = step_dir / "OUTCAR"
 
@@ -302,26 +433,211 @@ class VaspJob:
                 self.logger.error(error_message)
                 raise FileNotFoundError(error_message)
             
+            # ML_AB/ML_FF VASP лишь читает, поэтому входные файлы МО размещаются ссылками; выходные
+            # ML_ABN/ML_FFN копируются: при перезапуске этапа VASP перезаписывает их через O_TRUNC
             ml_abn_out = step_dir / "ML_ABN"
             ml_ffn_out = step_dir / "ML_FFN"
 
             if ml_abn_out.is_file() and self.ml_output is not None:
-                shutil.copy(ml_abn_out, self.ml_output / f"ML_ABN_{i}")
+                _export(ml_abn_out, self.ml_output / f"ML_ABN_{i}")
             
             if ml_ffn_out.is_file() and self.ml_output is not None:
-                shutil.copy(ml_ffn_out, self.ml_output / f"ML_FFN_{i}")
+                _export(ml_ffn_out, self.ml_output / f"ML_FFN_{i}")
+
+
+def _json_loads(data: bytes):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _json_dumps(obj) -> bytes:
+    # отступы в status.json только через orjson: у json они в разы дороже компактного вывода
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+    return json.dumps(obj, separators=(",", ":")).encode()
 
 
 def save_status(status_file: Path, status_data: dict) -> None:
-    with open(status_file, 'w') as f:
-        json.dump(status_data, f, indent=4)
+    # временный файл + os.replace: планировщик не увидит наполовину записанный status.json
+    tmp_file = status_file.with_name(f".{status_file.name}.tmp")
+    with open(tmp_file, "wb") as f:
+        f.write(_json_dumps(status_data))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, status_file)
+
+
+def _json_dumps_line(obj) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj) + b"\n"
+    return json.dumps(obj, separators=(",", ":")).encode() + b"\n"
 
 
 def load_status(status_file: Path) -> dict:
-    if status_file.is_file():
-        with open(status_file, 'r') as f:
-            return json.load(f)
-    return {}
+    try:
+        status_data = _json_loads(status_file.read_bytes())
+    except FileNotFoundError:
+        status_data = {}
+
+    # журнал остаётся, только если процесс не успел свести его в status.json
+    try:
+        journal = status_file.with_suffix(".jsonl").read_bytes()
+    except FileNotFoundError:
+        return status_data
+
+    jobs = status_data.setdefault("jobs", {})
+    for line in journal.splitlines():
+        try:
+            event = _json_loads(line)
+        except ValueError:
+            break  # последняя строка могла быть записана не полностью
+        jobs[event["job"]] = event["data"]
+    return status_data
+
+
+class StatusJournal():
+    """
+    Состояние задач в памяти: каждое изменение дописывается одной строкой
+    в status.jsonl, а полный status.json пишется один раз при завершении.
+    """
+
+    def __init__(self, status_file: Path):
+        self.status_file = status_file
+        self.journal_file = status_file.with_suffix(".jsonl")
+        self.data = load_status(status_file)
+        self.data.setdefault("jobs", {})
+        self._journal = None
+
+    def record(self, job_key: str) -> None:
+        if self._journal is None:
+            self._journal = open(self.journal_file, "ab")
+        self._journal.write(_json_dumps_line({"job": job_key, "data": self.data["jobs"][job_key]}))
+        self._journal.flush()
+
+    def close(self) -> None:
+        """Сводит журнал в status.json; повторный вызов ничего не делает."""
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+        if self.data is None:
+            return
+        save_status(self.status_file, self.data)
+        try:
+            self.journal_file.unlink()
+        except FileNotFoundError:
+            pass
+        self.data = None
+
+
+def _job_status_file(status_file: Path, job_index: int) -> Path:
+    return status_file.with_name(f"{status_file.stem}_{job_index}{status_file.suffix}")
+
+
+def reduce_job_statuses(status_file: Path) -> int:
+    """Сводит status_<N>.json задач массива в общий status.json; возвращает число сведённых файлов."""
+    # задача, прерванная до сведения журнала, оставляет только status_<N>.jsonl
+    pattern = re.compile(re.escape(status_file.stem) + r"_(\d+)\.jsonl?")
+    indices = sorted({int(m.group(1)) for m in map(pattern.fullmatch, os.listdir(status_file.parent)) if m})
+    parts = [_job_status_file(status_file, job_index) for job_index in indices]
+    if not parts:
+        return 0
+
+    status_data = load_status(status_file)
+    status_data.setdefault("jobs", {})
+    for part in parts:
+        status_data["jobs"].update(load_status(part).get("jobs", {}))
+    save_status(status_file, status_data)
+
+    # частичные файлы удаляются только после того, как общий статус записан
+    for part in parts:
+        for path in (part, part.with_suffix(".jsonl")):
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+    return len(parts)
+
+
+def _exit_on_sigterm(signum, frame):
+    # slurm шлёт SIGTERM перед снятием задания: выходим через sys.exit, чтобы сработал atexit
+    sys.exit(128 + signum)
+
+
+def run_job(job_key: str,
+            job_workdir: Path,
+            input_dir: Path,
+            poscar_file: Path,
+            vasp_cmd: str,
+            ml_input: Path,
+            ml_train: bool,
+            ml_refit: bool,
+            ml_predict: bool) -> dict:
+    """Запускает одну задачу VaspJob; возвращает поля для её записи в status.json."""
+    logger = logging.getLogger("TaskLogger")
+    result = {}
+    try:
+        job = VaspJob(workdir=job_workdir,
+                      inputdir=input_dir,
+                      initial_structure_filepath=poscar_file,
+                      logger=logger,
+                      task_cmd=vasp_cmd,
+                      ml_input=ml_input,
+                      ml_output=ml_input,
+                      ml_train=ml_train,
+                      ml_refit=ml_refit,
+                      ml_predict=ml_predict)
+        # NOTE: можно ли ситуативно делать refit?
+        job.run()
+    except VaspExecutionError as e:
+        logger.warning("Задача %s столкнулась с проблемой на стороне VASP: %s, дальнейшие шаги релаксации пропущены", job_key, e)
+        result["warning"] = str(e)
+    except FileNotFoundError as e:
+        logger.error("Задача %s столкнулась с ошибкой: %s", job_key, e)
+        result["status"] = "error"
+        result["error"] = str(e)
+    return result
+
+
+def finish_job(journal: StatusJournal, job_key: str, logger: logging.Logger) -> None:
+    journal.data["jobs"][job_key]["timestamp"] = datetime.now().isoformat()
+    journal.data["jobs"][job_key]["status"] = "success"
+
+    journal.record(job_key)
+    logger.info("Задача %s завершена, статус сохранен", job_key)
+
+
+def run_jobs_parallel(poscar_files,
+                      journal: StatusJournal,
+                      global_work_dir: Path,
+                      job_prefix: str,
+                      input_dir: Path,
+                      vasp_cmd: str,
+                      max_parallel_jobs: int,
+                      logger: logging.Logger) -> None:
+    # concurrent.futures.process тянет multiprocessing (~10 мс импорта), а нужен только здесь
+    from concurrent.futures import ProcessPoolExecutor
+
+    status_data = journal.data
+    with ProcessPoolExecutor(max_workers=max_parallel_jobs) as executor:
+        futures = {}
+        for poscar_file in poscar_files:
+            identifier = _suffix(_POSCAR_RE, poscar_file)
+            job_key = poscar_file.name
+
+            job_workdir = global_work_dir / f"{job_prefix}{identifier}"
+            logger.info("Запуск задачи %s в каталоге %s", job_key, job_workdir)
+            status_data["jobs"][job_key]["workdir"] = str(job_workdir)
+
+            future = executor.submit(run_job, job_key, job_workdir, input_dir, poscar_file, vasp_cmd,
+                                     input_dir, False, False, False)
+            futures[future] = job_key
+
+        # status.json меняет только этот процесс, по мере завершения задач
+        for future in as_completed(futures):
+            job_key = futures[future]
+            status_data["jobs"][job_key].update(future.result())
+            finish_job(journal, job_key, logger)
 
 
 def main():
@@ -330,6 +646,13 @@ def main():
                         required=False,
                         default="./config.json",
                         help="Путь к конфигурационному файлу (JSON)")
+    parser.add_argument("--single_job",
+                        required=False, type=int, nargs="?", const=-1, default=None,
+                        help="Рассчитать только POSCAR_<N> (задача массива Slurm); без значения N берётся\
+                            из SLURM_ARRAY_TASK_ID. Статус пишется в отдельный status_<N>.json")
+    parser.add_argument("--reduce",
+                        action="store_true",
+                        help="Свести статусы status_<N>.json задач массива в общий status.json и выйти")
     args = parser.parse_args()
 
 
@@ -337,8 +660,7 @@ def main():
     if not config_path.is_file():
         print(f"Конфигурационный файл не найден: {config_path}", file=sys.stderr)
         sys.exit(1)
-    with open(config_path, 'r') as f:
-        config: dict = json.load(f)
+    config: dict = _json_loads(config_path.read_bytes())
 
     try:
         input_dir = Path(config["input_dir"]).resolve()
@@ -351,6 +673,7 @@ def main():
         ml_train = str(config.get("ml_train", "")).lower() == "enable"
         ml_refit = str(config.get("ml_refit", "")).lower() == "enable"
         ml_predict = str(config.get("ml_predict", "")).lower() == "enable"
+        max_parallel_jobs = int(config.get("max_parallel_jobs", 1))
         #ml_input = config.get("ml_input", None)
 
     except KeyError as e:
@@ -375,20 +698,46 @@ def main():
     logger = logging.getLogger("TaskLogger")
 
     logger.info("Запуск верхнеуровневого скрипта для VaspJob задач с изоляцией этапов")
-    logger.info(f"Параметры: input_dir = {input_dir}, poscar_dir = {poscar_dir}, global_work_dir = {global_work_dir}")
-    logger.info(f"Команда VASP: {vasp_cmd}")
+    logger.info("Параметры: input_dir = %s, poscar_dir = %s, global_work_dir = %s", input_dir, poscar_dir, global_work_dir)
+    logger.info("Команда VASP: %s", vasp_cmd)
 
     global_work_dir.mkdir(parents=True, exist_ok=True)
 
-    status_data = load_status(status_file)
-    status_data.setdefault("jobs", {})
-
-    poscar_files = sorted(
-        poscar_dir.glob("POSCAR_*"),
-        key=lambda f: int(re.search(r'POSCAR_(\d+)', f.name).group(1))
-    )
+    if args.reduce:
+        reduced = reduce_job_statuses(status_file)
+        logger.info("Сведено статусов задач массива: %s", reduced)
+        return
+
+    job_index = args.single_job
+    if job_index == -1:
+        array_task_id = os.environ.get("SLURM_ARRAY_TASK_ID", "")
+        if not array_task_id.isdigit():
+            parser.error("--single_job без номера требует переменную окружения SLURM_ARRAY_TASK_ID")
+        job_index = int(array_task_id)
+    if job_index is not None:
+        # повторный запуск массива после --reduce: готовая структура уже записана в общий status.json
+        shared_job = load_status(status_file).get("jobs", {}).get(f"POSCAR_{job_index}", {})
+        if shared_job.get("status") == "success":
+            logger.info("Задача POSCAR_%s уже успешно завершена (%s), пропускаем", job_index, status_file)
+            return
+        # задачи массива идут одновременно, поэтому у каждой свой файл статуса
+        status_file = _job_status_file(status_file, job_index)
+        logger.info("Режим одной задачи: POSCAR_%s, статус в %s", job_index, status_file)
+
+    journal = StatusJournal(status_file)
+    atexit.register(journal.close)
+    signal.signal(signal.SIGTERM, _exit_on_sigterm)
+    status_data = journal.data
+
+    if job_index is not None:
+        poscar_files = [poscar_dir / f"POSCAR_{job_index}"]
+        if not poscar_files[0].is_file():
+            logger.error("Не найден файл %s", poscar_files[0])
+            sys.exit(1)
+    else:
+        poscar_files = _sorted_by_index(_list_prefix(poscar_dir, "POSCAR_"), _POSCAR_RE)
     if not poscar_files:
-        logger.error(f"Не найдено ни одного файла POSCAR_* в {poscar_dir}")
+        logger.error("Не найдено ни одного файла POSCAR_* в %s", poscar_dir)
         sys.exit(1)
 
     current_ml_input: Path = input_dir
@@ -403,56 +752,47 @@ def main():
             "warning": "",
             }
 
+    # при повторном запуске готовые задачи отсеиваются одним проходом по множеству
+    done = {job_key for job_key, job in status_data["jobs"].items() if job.get("status") == "success"}
+    if done:
+        poscar_files = [poscar_file for poscar_file in poscar_files if poscar_file.name not in done]
+        logger.info("Уже успешно завершено задач: %s, пропускаем их", len(done))
+
+    ml_enabled = ml_train or ml_refit or ml_predict
+    if max_parallel_jobs > 1 and not ml_enabled:
+        # без МО задачи независимы; с МО каждая следующая берёт ML_AB/ML_FF предыдущей
+        run_jobs_parallel(poscar_files, journal, global_work_dir, job_prefix,
+                          input_dir, vasp_cmd, max_parallel_jobs, logger)
+        journal.close()
+        logger.info("Все задачи обработаны.")
+        return
+
     for poscar_file in poscar_files:
-        logger.debug(f"Входные файлы MLFF берём из {current_ml_input}")
+        logger.debug("Входные файлы MLFF берём из %s", current_ml_input)
 
-        identifier = re.search(r'POSCAR_(\d+)', poscar_file.name).group(1)
+        identifier = _suffix(_POSCAR_RE, poscar_file)
         job_key = poscar_file.name 
 
-        job_status = status_data["jobs"].get(job_key, {}).get("status", "not-finished")
-        if  job_status == "success":
-            logger.info(f"Задача {job_key} уже успешно завершена, пропускаем")
-            continue
-
+        job_status = status_data["jobs"][job_key]["status"]
         if job_status == "failed":
-            logger.info(f"Задача {job_key} во время предыдущего запуска завершилась с ошибкой и будет перезапущена")
+            logger.info("Задача %s во время предыдущего запуска завершилась с ошибкой и будет перезапущена", job_key)
 
         job_workdir = global_work_dir / f"{job_prefix}{identifier}"
-        logger.info(f"Запуск задачи {job_key} в каталоге {job_workdir}")
+        logger.info("Запуск задачи %s в каталоге %s", job_key, job_workdir)
 
         status_data["jobs"][job_key]["workdir"] =  str(job_workdir)
 
-        try:
-            job = VaspJob(workdir=job_workdir,
-                          inputdir=input_dir,
-                          initial_structure_filepath=poscar_file,
-                          logger=logger,
-                          task_cmd=vasp_cmd,
-                          ml_input=current_ml_input,
-                          ml_output=current_ml_input,
-                          ml_train=ml_train,
-                          ml_refit=ml_refit,
-                          ml_predict=ml_predict)
-            # NOTE: можно ли ситуативно делать refit?
-            job.run()
-        except VaspExecutionError as e:
-            logger.warning(f"Задача {job_key} столкнулась с проблемой на стороне VASP: {e}, дальнейшие шаги релаксации пропущены")
-            status_data["jobs"][job_key]["warning"] = str(e)
-        except FileNotFoundError as e:
-            logger.error(f"Задача {job_key} столкнулась с ошибкой: {e}")
-            status_data["jobs"][job_key]["status"] = "error"
-            status_data["jobs"][job_key]["error"] = str(e)
-        
+        status_data["jobs"][job_key].update(
+            run_job(job_key, job_workdir, input_dir, poscar_file, vasp_cmd,
+                    current_ml_input, ml_train, ml_refit, ml_predict))
+
         if ml_refit:
             ml_refit = False
             ml_predict = True
 
-        status_data["jobs"][job_key]["timestamp"] = datetime.now().isoformat()
-        status_data["jobs"][job_key]["status"] = "success"
-
-        save_status(status_file, status_data)
-        logger.info(f"Задача {job_key} завершена, статус сохранен")
+        finish_job(journal, job_key, logger)
 
+    journal.close()
     logger.info("Все задачи обработаны.")
 
 if __name__ == "__main__":
@@ -1,24 +1,28 @@
+from textual import on
 from textual.app import App, ComposeResult
+from textual.reactive import reactive
 from textual.widgets import Header, Footer, Button, Static
 
+_COUNTER_PREFIX = "Счётчик: "
+
+
 class MyApp(App):
+    # reactive: Textual сам перерисовывает виджет через watch_count, частые изменения не плодят отрисовок
+    count = reactive(0, init=False)  # начальное значение уже показано в compose
+
     def compose(self) -> ComposeResult:
+        self._counter_widget = Static(_COUNTER_PREFIX + "0", id="counter")
         yield Header()
-        yield Static("Нажми кнопку, чтобы увеличить счётчик:", id="prompt")
-        yield Button("Нажми меня", id="increment")
-        yield Static("Счётчик: 0", id="counter")
+        yield Button("Нажми, чтобы увеличить счётчик", id="increment")
+        yield self._counter_widget
         yield Footer()
 
-    def on_button_pressed(self, event: Button.Pressed) -> None:
-        if event.button.id == "increment":
-            counter_widget = self.query_one("#counter", Static)
-            try:
-                current_text = counter_widget.renderable
-                current_count = int(str(current_text).split(":")[1].strip())
-            except Exception:
-                current_count = 0
-            current_count += 1
-            counter_widget.update(f"Счётчик: {current_count}")
+    @on(Button.Pressed, "#increment")
+    def increment(self) -> None:
+        self.count += 1
+
+    def watch_count(self, count: int) -> None:
+        self._counter_widget.update(_COUNTER_PREFIX + str(count))
 
 if __name__ == "__main__":
     MyApp().run()
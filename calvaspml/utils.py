@@ -1,12 +1,164 @@
+import errno
 import hashlib
+import os
+import shutil
 from pathlib import Path
+from typing import Dict
 
 
-def file_checksum(file_path: Path, algorithm="md5") -> str:
-    hash_func = hashlib.new(algorithm)
+_CHECKSUM_CHUNK = 1 << 20
+
 
+def file_checksum(file_path: Path, algorithm="md5") -> str:
+    """Контрольная сумма файла; md5 по умолчанию ради совместимости с уже посчитанными суммами."""
     with open(file_path, "rb") as f:
-        for chunk in iter(lambda: f.read(4096), b""):
+        if hasattr(hashlib, "file_digest"):  # Python >= 3.11: цикл чтения целиком в C
+            return hashlib.file_digest(f, algorithm).hexdigest()
+
+        hash_func = hashlib.new(algorithm)
+        for chunk in iter(lambda: f.read(_CHECKSUM_CHUNK), b""):
             hash_func.update(chunk)
 
-    return hash_func.hexdigest()
\ No newline at end of file
+    return hash_func.hexdigest()
+
+
+# ошибки, при которых системный вызов просто не поддерживается для этой пары файлов
+_COPY_FALLBACK_ERRNOS = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP,
+                         errno.ENOTSUP, errno.EBADF, errno.EPERM}
+_COPY_CHUNK = 1 << 30
+
+
+def _copy_fds(src_fd: int, dst_fd: int) -> bool:
+    size = os.fstat(src_fd).st_size
+    copy_file_range = getattr(os, "copy_file_range", None)
+    if copy_file_range is not None:
+        try:
+            # на xfs/btrfs ядро делает reflink без переноса данных
+            copied = 0
+            while True:
+                n = copy_file_range(src_fd, dst_fd, _COPY_CHUNK)
+                if not n:
+                    break
+                copied += n
+            # для некоторых ФС (procfs, сетевые, overlay) вызов возвращает 0 раньше конца файла
+            if copied and copied >= size:
+                return True
+        except OSError as e:
+            if e.errno not in _COPY_FALLBACK_ERRNOS:
+                raise
+
+    sendfile = getattr(os, "sendfile", None)
+    if sendfile is not None:
+        # продолжаем с позиции, до которой мог дойти copy_file_range
+        offset = os.lseek(src_fd, 0, os.SEEK_CUR)
+        try:
+            while True:
+                sent = sendfile(dst_fd, src_fd, offset, _COPY_CHUNK)
+                if not sent:
+                    return offset >= size
+                offset += sent
+        except OSError as e:
+            if e.errno not in _COPY_FALLBACK_ERRNOS:
+                raise
+
+    return False
+
+
+def _fadvise(fd: int, advice: str) -> None:
+    # posix_fadvise есть не везде (нет на macOS); подсказка необязательна, ошибки игнорируем
+    if hasattr(os, "posix_fadvise"):
+        try:
+            os.posix_fadvise(fd, 0, 0, getattr(os, advice))
+        except OSError:
+            pass
+
+
+def prefetch(path: Path) -> None:
+    """Просит ядро заранее прочитать файл в page cache (POSIX_FADV_WILLNEED), не дожидаясь чтения."""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        _fadvise(fd, "POSIX_FADV_WILLNEED")
+    finally:
+        os.close(fd)
+
+
+def fast_copy(src: Path, dst: Path) -> None:
+    """Копирует содержимое файла внутри ядра: copy_file_range, затем sendfile, затем shutil.copyfile."""
+    src_fd = os.open(src, os.O_RDONLY)
+    try:
+        # O_TRUNC по жёсткой ссылке на src обнулил бы сам источник
+        try:
+            if os.path.samestat(os.fstat(src_fd), os.stat(dst)):
+                raise shutil.SameFileError(f"{src} и {dst} - один и тот же файл")
+        except FileNotFoundError:
+            pass
+        _fadvise(src_fd, "POSIX_FADV_SEQUENTIAL")
+        dst_fd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666)
+        try:
+            if _copy_fds(src_fd, dst_fd):
+                return
+        finally:
+            os.close(dst_fd)
+    finally:
+        os.close(src_fd)
+
+    shutil.copyfile(src, dst)
+
+
+class InotifyWatcher():
+    """Наблюдение за директориями через inotify (ctypes); без поддержки в системе fd = None."""
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    # каждое наблюдение расходует fs.inotify.max_user_watches; сверх лимита директория не наблюдается
+    # и изменения в ней замечаются только по таймауту ожидания
+    MAX_WATCHES = 64
+
+    def __init__(self):
+        self.fd = None
+        self._watched: Dict[Path, int] = {}
+        try:
+            import ctypes
+            libc = ctypes.CDLL(None, use_errno=True)
+            fd = libc.inotify_init1(os.O_CLOEXEC | os.O_NONBLOCK)
+        except (OSError, AttributeError):
+            return
+        if fd >= 0:
+            self._libc = libc
+            self.fd = fd
+
+    def add(self, path: Path) -> None:
+        if self.fd is None or path in self._watched or len(self._watched) >= self.MAX_WATCHES:
+            return
+        mask = self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_CREATE
+        # при ENOSPC (исчерпан max_user_watches) wd < 0, директория остаётся без наблюдения
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(str(path)), mask)
+        if wd >= 0:
+            self._watched[path] = wd
+
+    def remove(self, path: Path) -> None:
+        wd = self._watched.pop(path, None)
+        if wd is not None and self.fd is not None:
+            # если директорию уже удалили, ядро само сняло наблюдение и вернёт EINVAL
+            self._libc.inotify_rm_watch(self.fd, wd)
+
+    def drain(self) -> bool:
+        """Вычитывает накопившиеся события; True, если они были."""
+        if self.fd is None:
+            return False
+        got_events = False
+        try:
+            while os.read(self.fd, 65536):
+                got_events = True
+        except BlockingIOError:
+            pass
+        return got_events
+
+    def close(self) -> None:
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+            self._watched.clear()
@@ -4,6 +4,8 @@
 import os
 import sys
 import math
+import itertools
+import numpy as np
 def writekp(kgrid, caldir='./'):
     '''
     
@@ -11,54 +13,27 @@ def writekp(kgrid, caldir='./'):
     - `kgrid` : Kmesh
     '''
     # read the lattice
-    def dot(x, y):
-        return x[0]*y[0] + x[1]*y[1] + x[2]*y[2]
-    def cross(x, y):
-        z1 = x[1]*y[2] - x[2]*y[1]
-        z2 = x[2]*y[0] - x[0]*y[2]
-        z3 = x[0]*y[1] - x[1]*y[0]
-        return [z1, z2, z3]
-    def kmf(kgrid, gi):
-        kd = int(gi/kgrid/2.0/math.pi)
-        if kd == 0: kd = 1
-        dd = gi/kd/2.0/math.pi
-        if dd >= kgrid:
-            for i in range(0, 10):
-                kd += i
-                dd = gi/kd/2.0/math.pi
-                if dd <= kgrid: break
-        return kd 
-                    
-    f = open(caldir + '/POSCAR')
-    pp = []
+    # only the comment, scale and three lattice lines are needed, not the atoms
+    with open(os.path.join(caldir, 'POSCAR')) as f:
+        head = list(itertools.islice(f, 5))
+    l = np.array([list(map(float, line.split())) for line in head[2:5]])
+    # rows of 2*pi*inv(L)^T are the reciprocal vectors (cross products over the volume)
+    g = 2.0 * math.pi * np.linalg.inv(l).T
+    rl = np.linalg.norm(g, axis=1)
+    # smallest division count with spacing gi/(2*pi*kd) <= kgrid along each axis
+    kmesh = np.maximum(1, np.ceil(rl / (2.0 * math.pi * kgrid))).astype(int).tolist()
+    content = 'A\n0\nG\n' + '%2d %2d %2d\n' % tuple(kmesh) + '%2d %2d %2d\n' % (0,0,0)
+    kpoints = os.path.join(caldir, 'KPOINTS')
+    # between relaxation steps the lattice barely drifts and the mesh stays the same,
+    # so an identical KPOINTS is left untouched
     try:
-        for line in f:
-            pp.append(line.split())
-    finally:
-        f.close()
-    l = []
-    for item in pp[2:5]:
-        l.append(list(map(float, item)))
-    c = cross(l[1], l[2])
-    volume = dot(l[0], c)
-    g = []
-    g1 = [ 2.0 * math.pi * item / volume for item in c]
-    c = cross(l[2], l[0])
-    g2 = [ 2.0 * math.pi * item / volume for item in c]
-    c = cross(l[0], l[1])
-    g3 = [ 2.0 * math.pi * item / volume for item in c]
-    g = [g1, g2, g3]
-    
-    rl = []
-    for i in range(0, 3):
-        rl.append(math.sqrt(dot(g[i],g[i])))
-    kmesh = []
-    for i in range(0, 3):
-        kmesh.append(kmf(kgrid, rl[i]))
-    f = open(caldir + '/KPOINTS', 'w')
-    f.write('A\n0\nG\n')
-    f.write('%2d %2d %2d\n' % tuple(kmesh))
-    f.write('%2d %2d %2d\n' % (0,0,0))
+        with open(kpoints) as f:
+            if f.read() == content:
+                return
+    except OSError:
+        pass
+    f = open(kpoints, 'w')
+    f.write(content)
     f.close()
 
 if __name__ == '__main__':